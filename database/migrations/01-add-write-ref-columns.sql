@@ -0,0 +1,14 @@
+-- =============================================================================
+-- Add write_ref idempotency keys
+-- =============================================================================
+-- The agent's write-behind pipeline stores each journal reference in write_ref,
+-- so a batch replayed after a crash returns the rows it already inserted
+-- instead of inserting them again. Required by create-users-batch and
+-- book-hotels-batch in mcp-toolbox/tools.yaml.
+-- =============================================================================
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS write_ref VARCHAR UNIQUE;
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS write_ref VARCHAR UNIQUE;
+
+COMMENT ON COLUMN users.write_ref IS 'Idempotency key for writes replayed by the agent write-behind pipeline';
+COMMENT ON COLUMN bookings.write_ref IS 'Idempotency key for writes replayed by the agent write-behind pipeline';
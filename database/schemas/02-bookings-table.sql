@@ -15,6 +15,7 @@ CREATE TABLE bookings (
     check_in     DATE NOT NULL,
     check_out    DATE NOT NULL,
     guests       INT NOT NULL DEFAULT 1, -- number of guests
+    write_ref    VARCHAR UNIQUE,         -- agent write journal reference
     created_at   TIMESTAMP DEFAULT NOW(),
 
     -- Add FK constraint to hotels table
@@ -31,4 +32,5 @@ COMMENT ON COLUMN bookings.hotel_id IS 'Reference to hotels table';
 COMMENT ON COLUMN bookings.check_in IS 'Check-in date';
 COMMENT ON COLUMN bookings.check_out IS 'Check-out date';
 COMMENT ON COLUMN bookings.guests IS 'Number of guests';
+COMMENT ON COLUMN bookings.write_ref IS 'Idempotency key for writes replayed by the agent write-behind pipeline';
 COMMENT ON COLUMN bookings.created_at IS 'Booking creation timestamp';
@@ -16,6 +16,7 @@ CREATE TABLE users (
     name        VARCHAR NOT NULL,
     email       VARCHAR UNIQUE NOT NULL,
     phone       VARCHAR,
+    write_ref   VARCHAR UNIQUE,
     created_at  TIMESTAMP DEFAULT NOW()
 );
 
@@ -25,4 +26,5 @@ COMMENT ON COLUMN users.user_id IS 'Unique user identifier (UUID)';
 COMMENT ON COLUMN users.name IS 'User full name';
 COMMENT ON COLUMN users.email IS 'User email address (unique)';
 COMMENT ON COLUMN users.phone IS 'User phone number';
+COMMENT ON COLUMN users.write_ref IS 'Idempotency key for writes replayed by the agent write-behind pipeline';
 COMMENT ON COLUMN users.created_at IS 'User registration timestamp';
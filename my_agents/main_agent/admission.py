@@ -0,0 +1,275 @@
+import os
+import json
+import math
+import time
+import asyncio
+from collections import defaultdict, deque
+
+# ----------------------------
+# Admission control and load shedding for agent endpoints
+# ----------------------------
+# Every agent run holds a slot for its full duration (including streamed
+# bodies). Requests beyond the global or per-client limit wait in a bounded
+# FIFO queue; when the queue is full, or the expected wait exceeds the
+# request's deadline, they are rejected immediately with 429 + Retry-After.
+# Endpoints outside ADMISSION_PATHS (e.g. /health, /info) bypass the queue.
+
+ADMISSION_GLOBAL_LIMIT = int(os.getenv("ADMISSION_GLOBAL_LIMIT", "16"))
+ADMISSION_PER_CLIENT_LIMIT = int(os.getenv("ADMISSION_PER_CLIENT_LIMIT", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+ADMISSION_PATHS = {"/chat", "/chat/stream", "/run", "/run_sse"}
+# Number of trusted proxies in front of the server that append to X-Forwarded-For.
+# 0 keys clients on the peer address. Defaults to 1 on Cloud Run (K_SERVICE is
+# set), where every peer address is the front-end proxy's.
+ADMISSION_TRUSTED_PROXY_HOPS = int(os.getenv(
+    "ADMISSION_TRUSTED_PROXY_HOPS", "1" if os.getenv("K_SERVICE") else "0"
+))
+# Only enable behind an authenticating gateway that sets X-Client-Id itself
+ADMISSION_TRUST_CLIENT_ID = os.getenv("ADMISSION_TRUST_CLIENT_ID", "false").lower() == "true"
+
+# Seed for the service-time average before any request has completed
+_INITIAL_SERVICE_SECONDS = 5.0
+_EWMA_ALPHA = 0.2
+_WAIT_SAMPLES = 1024
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Global and per-client concurrency limiter with a bounded, deadline-aware wait queue.
+
+    Runs on a single event loop, so state is mutated without locks.
+    """
+
+    def __init__(self, global_limit: int = ADMISSION_GLOBAL_LIMIT,
+                 per_client_limit: int = ADMISSION_PER_CLIENT_LIMIT,
+                 max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_wait: float = ADMISSION_MAX_WAIT_SECONDS):
+        self.global_limit = global_limit
+        self.per_client_limit = per_client_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.active_by_client = defaultdict(int)
+        self._waiters = deque()
+        self._service_ewma = _INITIAL_SERVICE_SECONDS
+        self._wait_samples = deque(maxlen=_WAIT_SAMPLES)
+        self.admitted_total = 0
+        self.rejected_total = defaultdict(int)
+
+    # ----------------------------
+    # Slot management
+    # ----------------------------
+    def _has_capacity(self, client_id: str) -> bool:
+        return (self.active < self.global_limit
+                and self.active_by_client.get(client_id, 0) < self.per_client_limit)
+
+    def _grant(self, client_id: str):
+        self.active += 1
+        self.active_by_client[client_id] += 1
+        self.admitted_total += 1
+
+    def estimated_wait(self, position: int) -> float:
+        """Expected seconds until the request at queue ``position`` (0-based) gets a slot.
+
+        With every slot busy, one frees up roughly every ewma / global_limit seconds.
+        """
+        return self._service_ewma * (position + 1) / max(self.global_limit, 1)
+
+    def _reject(self, reason: str, estimate: float):
+        self.rejected_total[reason] += 1
+        raise AdmissionRejected(reason, max(1, math.ceil(estimate)))
+
+    async def acquire(self, client_id: str, deadline: float = None):
+        """Wait for a slot or raise AdmissionRejected. ``deadline`` is seconds of acceptable wait."""
+        deadline = self.max_wait if deadline is None else min(deadline, self.max_wait)
+        if not self._waiters and self._has_capacity(client_id):
+            self._grant(client_id)
+            self._wait_samples.append(0.0)
+            return
+
+        position = len(self._waiters)
+        if position >= self.max_queue:
+            self._reject("queue_full", self.estimated_wait(position))
+        estimate = self.estimated_wait(position)
+        if estimate > deadline:
+            self._reject("deadline", estimate)
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (client_id, waiter, time.monotonic())
+        self._waiters.append(entry)
+        # A queued request may be admissible now if the waiters ahead are blocked on their client limit
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=deadline)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the deadline expired; keep the slot
+                pass
+            else:
+                self._waiters.remove(entry)
+                self._reject("timeout", self.estimated_wait(len(self._waiters)))
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(client_id)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+            raise
+        self._wait_samples.append(time.monotonic() - entry[2])
+
+    def release(self, client_id: str, service_seconds: float = None):
+        self.active -= 1
+        self.active_by_client[client_id] -= 1
+        if self.active_by_client[client_id] <= 0:
+            del self.active_by_client[client_id]
+        if service_seconds is not None:
+            self._service_ewma += _EWMA_ALPHA * (service_seconds - self._service_ewma)
+        self._wake()
+
+    def _wake(self):
+        """Hand free slots to the oldest waiters whose client is under its limit"""
+        for entry in list(self._waiters):
+            if self.active >= self.global_limit:
+                break
+            client_id, waiter, _ = entry
+            if waiter.done():
+                self._waiters.remove(entry)
+                continue
+            if self._has_capacity(client_id):
+                self._waiters.remove(entry)
+                self._grant(client_id)
+                waiter.set_result(True)
+
+    # ----------------------------
+    # Metrics
+    # ----------------------------
+    def snapshot(self) -> dict:
+        waits = sorted(self._wait_samples)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return {
+            "active": self.active,
+            "queue_depth": len(self._waiters),
+            "global_limit": self.global_limit,
+            "per_client_limit": self.per_client_limit,
+            "max_queue": self.max_queue,
+            "admitted_total": self.admitted_total,
+            "rejected_total": dict(self.rejected_total),
+            "wait_seconds_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_seconds_p95": p95,
+            "service_seconds_ewma": self._service_ewma,
+        }
+
+    def prometheus(self) -> str:
+        s = self.snapshot()
+        lines = [
+            "# TYPE agent_admission_active gauge",
+            f"agent_admission_active {s['active']}",
+            "# TYPE agent_admission_queue_depth gauge",
+            f"agent_admission_queue_depth {s['queue_depth']}",
+            "# TYPE agent_admission_admitted_total counter",
+            f"agent_admission_admitted_total {s['admitted_total']}",
+            "# TYPE agent_admission_rejected_total counter",
+        ]
+        for reason in ("queue_full", "deadline", "timeout"):
+            lines.append(f'agent_admission_rejected_total{{reason="{reason}"}} {s["rejected_total"].get(reason, 0)}')
+        lines += [
+            "# TYPE agent_admission_wait_seconds gauge",
+            f'agent_admission_wait_seconds{{stat="avg"}} {s["wait_seconds_avg"]:.4f}',
+            f'agent_admission_wait_seconds{{stat="p95"}} {s["wait_seconds_p95"]:.4f}',
+            "# TYPE agent_admission_service_seconds_ewma gauge",
+            f"agent_admission_service_seconds_ewma {s['service_seconds_ewma']:.4f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _header(scope, name: bytes):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def client_identity(scope, trusted_hops: int = ADMISSION_TRUSTED_PROXY_HOPS,
+                    trust_client_id: bool = ADMISSION_TRUST_CLIENT_ID) -> str:
+    """Identify the caller for the per-client limit.
+
+    Client-controlled values are never trusted by default: X-Client-Id is used only
+    when ``trust_client_id`` is set, and X-Forwarded-For is read from the right,
+    taking the address appended by the outermost of ``trusted_hops`` proxies.
+    """
+    if trust_client_id:
+        client_id = _header(scope, b"x-client-id")
+        if client_id:
+            return client_id
+    if trusted_hops > 0:
+        forwarded = _header(scope, b"x-forwarded-for")
+        hops = [hop.strip() for hop in forwarded.split(",")] if forwarded else []
+        if len(hops) >= trusted_hops:
+            return hops[-trusted_hops]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class AdmissionMiddleware:
+    """ASGI middleware gating agent endpoints through an AdmissionController.
+
+    Implemented at the ASGI layer so the slot is held until a streamed
+    response has been fully sent. Clients may shorten their queue deadline
+    with an ``X-Request-Deadline`` header (seconds).
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths=ADMISSION_PATHS):
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        client_id = client_identity(scope)
+        deadline = None
+        raw_deadline = _header(scope, b"x-request-deadline")
+        if raw_deadline:
+            try:
+                deadline = max(0.0, float(raw_deadline))
+            except ValueError:
+                pass
+
+        try:
+            await self.controller.acquire(client_id, deadline)
+        except AdmissionRejected as e:
+            await self._send_429(send, e)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(client_id, time.monotonic() - started)
+
+    @staticmethod
+    async def _send_429(send, rejection: AdmissionRejected):
+        body = json.dumps({
+            "status": "rejected",
+            "reason": rejection.reason,
+            "detail": "Server is busy, please retry shortly.",
+            "retry_after": rejection.retry_after,
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(rejection.retry_after).encode()),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
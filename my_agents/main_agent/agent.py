@@ -1,7 +1,10 @@
 import os
+import json
+import datetime
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from google.adk.agents import Agent
-from google.adk.tools import FunctionTool 
+from google.adk.tools import FunctionTool, ToolContext
 from toolbox_core import ToolboxSyncClient
 
 # ----------------------------
@@ -122,9 +125,139 @@ for tool in raw_hotel_tools:
 
 print(f"📋 Tool registry: {list(tool_registry.keys())}")
 
+# ----------------------------
+# Optional direct Postgres backend for the postgres-sql tools
+# ----------------------------
+# TOOL_BACKEND=postgres runs the tools.yaml statements on a local asyncpg pool
+# instead of calling the toolbox; BigQuery tools still go through the toolbox.
+TOOL_BACKEND = os.getenv("TOOL_BACKEND", "toolbox").lower()
+
+postgres_executor = None
+if TOOL_BACKEND == "postgres":
+    try:
+        try:
+            from .pg_backend import PostgresToolExecutor
+        except ImportError:
+            from pg_backend import PostgresToolExecutor
+        postgres_executor = PostgresToolExecutor().start()
+        for name in postgres_executor.tools:
+            tool_registry[name] = postgres_executor.tool_function(name)
+        print(f"✅ Direct Postgres backend serving: {list(postgres_executor.tools.keys())}")
+    except Exception as e:
+        # Silently falling back would hide a misconfigured deployment behind toolbox latency
+        raise RuntimeError(f"TOOL_BACKEND=postgres but the direct Postgres backend failed to start: {e}") from e
+
+def lookup_tool_function(tool_name):
+    """Return the callable for a registered MCP tool, or None if unavailable"""
+    tool = tool_registry.get(tool_name)
+    return get_tool_function(tool) if tool else None
+
+def parse_tool_rows(result) -> list:
+    """Normalise a wrapper/toolbox result (JSON text, dict or list) into a list of row dicts"""
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except ValueError:
+            return []
+    if isinstance(result, dict):
+        return [] if "error" in result else [result]
+    if isinstance(result, list):
+        return [row for row in result if isinstance(row, dict)]
+    return []
+
+# ----------------------------
+# Write-behind pipeline for user registration and bookings
+# ----------------------------
+try:
+    from .write_pipeline import WritePipeline, KIND_CREATE_USER, KIND_BOOK_HOTEL, USER_REF_PREFIX
+except ImportError:
+    from write_pipeline import WritePipeline, KIND_CREATE_USER, KIND_BOOK_HOTEL, USER_REF_PREFIX
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+
+write_behind = None
+if WRITE_BEHIND_ENABLED and not IS_LOCAL_DEVELOPMENT and not os.getenv("WRITE_JOURNAL_PATH"):
+    # The default journal lives in the temp dir, which is in-memory on Cloud Run and
+    # lost when the instance stops; queued writes would not survive a restart there
+    print("⚠️ WRITE_JOURNAL_PATH is not set to persistent storage, using synchronous writes")
+elif WRITE_BEHIND_ENABLED:
+    try:
+        write_behind = WritePipeline(lookup_tool_function)
+        # Starting the worker replays anything journalled before a restart
+        write_behind.start()
+        print(f"✅ Write-behind pipeline journaling to {write_behind.journal.path}")
+    except Exception as e:
+        print("⚠️ Failed to start write-behind pipeline, falling back to synchronous writes:", e)
+        write_behind = None
+
+def _resolve_user_reference(user_id: str):
+    """Map a provisional user reference to (user_id, None), or (None, status dict) until it commits"""
+    if not (write_behind and user_id.startswith(USER_REF_PREFIX)):
+        return user_id, None
+    status = write_behind.status(user_id)
+    committed = (status.get("result") or {}).get("user_id")
+    if status["status"] == "committed" and committed:
+        return str(committed), None
+    return None, status
+
+# ----------------------------
+# Unified ranked hotel search index
+# ----------------------------
+try:
+    from .hotel_search import HotelSearchEngine
+except ImportError:
+    from hotel_search import HotelSearchEngine
+
+def _load_tool_rows(tool_name):
+    def load():
+        func = lookup_tool_function(tool_name)
+        if not func:
+            raise RuntimeError(f"Tool '{tool_name}' not found in registry")
+        result = func()
+        rows = parse_tool_rows(result)
+        if not rows:
+            # An error or unparseable result must not look like an empty catalogue
+            raise RuntimeError(f"Tool '{tool_name}' returned no rows: {str(result)[:200]}")
+        return rows
+    return load
+
+hotel_search_engine = HotelSearchEngine(_load_tool_rows("list-hotels"), _load_tool_rows("list-hotel-attributes"))
+
 # ----------------------------
 # Create wrapper functions with improved error handling
 # ----------------------------
+def _write_tools_missing(kind: str, tool_name: str):
+    """Error dict when no tool can apply a queued write, so it is refused up front"""
+    if write_behind.can_write(kind):
+        return None
+    return {"error": f"Tool '{tool_name}' not found in registry. Available: {list(tool_registry.keys())}"}
+
+def _validate_booking(hotel_id, check_in: str, check_out: str, guests):
+    """Normalise booking input, returning (values, None) or (None, error dict)"""
+    try:
+        hotel_id = int(hotel_id)
+    except (TypeError, ValueError):
+        return None, {"error": f"Invalid hotel_id '{hotel_id}': expected a numeric hotel ID"}
+    try:
+        check_in_date = datetime.datetime.strptime(str(check_in).strip(), "%Y-%m-%d").date()
+        check_out_date = datetime.datetime.strptime(str(check_out).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None, {"error": f"Invalid dates '{check_in}'/'{check_out}': use YYYY-MM-DD format"}
+    if check_out_date <= check_in_date:
+        return None, {"error": "Check-out date must be after the check-in date"}
+    try:
+        guests = int(guests)
+    except (TypeError, ValueError):
+        guests = 0
+    if guests < 1:
+        return None, {"error": "Number of guests must be at least 1"}
+    return {
+        "hotel_id": str(hotel_id),
+        "check_in": check_in_date.isoformat(),
+        "check_out": check_out_date.isoformat(),
+        "guests": guests,
+    }, None
+
 def create_user_wrapper(name: str, email: str, phone: str) -> dict:
     """Create a new user account.
     
@@ -134,9 +267,26 @@ def create_user_wrapper(name: str, email: str, phone: str) -> dict:
         phone: Phone number of the user
     
     Returns:
-        Dictionary with user creation result including user_id
+        Dictionary with user creation result. When writes are queued this holds a
+        provisional reference (usable as user_id for bookings) instead of user_id.
     """
     tool_name = "create-user"
+    if write_behind:
+        if "@" not in email:
+            return {"error": f"Invalid email address '{email}'"}
+        missing = _write_tools_missing(KIND_CREATE_USER, tool_name)
+        if missing:
+            return missing
+        try:
+            reference = write_behind.submit(KIND_CREATE_USER, {"name": name, "email": email, "phone": phone})
+        except Exception as e:
+            return {"error": f"Failed to queue user creation: {str(e)}"}
+        return {
+            "status": "pending",
+            "reference": reference,
+            "user_id": reference,
+            "message": "Registration accepted. Use get_write_status_wrapper with the reference to get the final user_id.",
+        }
     if tool_name not in tool_registry:
         return {"error": f"Tool '{tool_name}' not found in registry. Available: {list(tool_registry.keys())}"}
     
@@ -151,27 +301,20 @@ def create_user_wrapper(name: str, email: str, phone: str) -> dict:
         return {"error": f"Failed to create user: {str(e)}"}
 
 def search_hotels_wrapper(query: str) -> dict:
-    """Search for hotels by name, location, or traveler type.
+    """Search for hotels by name, location, price tier or traveler type in one ranked query.
     
     Args:
-        query: Search query for hotels
+        query: Free-text search, e.g. "romantic luxury Goa" or "family hotel Zurich budget"
     
     Returns:
-        Dictionary with hotel search results
+        Dictionary with hotels ranked by relevance, including rating, avg_price_per_night,
+        kid_friendly and romantic attributes
     """
-    tool_name = "search-hotels"
-    if tool_name not in tool_registry:
-        return {"error": f"Tool '{tool_name}' not found in registry. Available: {list(tool_registry.keys())}"}
-    
-    tool = tool_registry[tool_name]
-    func = get_tool_function(tool)
-    if not func:
-        return {"error": f"No callable function found for tool '{tool_name}'"}
-    
     try:
-        return func(query=query)
+        results = hotel_search_engine.search(query)
     except Exception as e:
         return {"error": f"Failed to search hotels: {str(e)}"}
+    return {"status": "success", "query": query, "results": results}
 
 def book_hotel_wrapper(user_id: str, hotel_id: str, check_in: str, check_out: str, guests: int) -> dict:
     """Book a hotel for a user.
@@ -184,9 +327,26 @@ def book_hotel_wrapper(user_id: str, hotel_id: str, check_in: str, check_out: st
         guests: Number of guests
     
     Returns:
-        Dictionary with booking result
+        Dictionary with booking result. When writes are queued this holds a
+        provisional booking reference instead of booking_id.
     """
     tool_name = "book-hotel"
+    if write_behind:
+        booking, invalid = _validate_booking(hotel_id, check_in, check_out, guests)
+        if invalid:
+            return invalid
+        missing = _write_tools_missing(KIND_BOOK_HOTEL, tool_name)
+        if missing:
+            return missing
+        try:
+            reference = write_behind.submit(KIND_BOOK_HOTEL, dict(booking, user_id=user_id))
+        except Exception as e:
+            return {"error": f"Failed to queue booking: {str(e)}"}
+        return {
+            "status": "pending",
+            "reference": reference,
+            "message": "Booking accepted. Use get_write_status_wrapper with the reference to confirm the booking_id.",
+        }
     if tool_name not in tool_registry:
         return {"error": f"Tool '{tool_name}' not found in registry. Available: {list(tool_registry.keys())}"}
     
@@ -204,11 +364,21 @@ def list_bookings_wrapper(user_id: str) -> dict:
     """List all bookings for a user.
     
     Args:
-        user_id: ID of the user
+        user_id: ID of the user, or the provisional reference returned by create_user_wrapper
     
     Returns:
         Dictionary with user's booking list
     """
+    user_id, pending = _resolve_user_reference(str(user_id))
+    if pending:
+        if pending["status"] in ("failed", "unknown"):
+            return {"error": f"Registration '{pending['reference']}' did not complete: "
+                             f"{pending.get('error') or pending.get('message')}"}
+        return dict(pending, message="Registration is still being saved, so there are no bookings to list yet. "
+                                     "Check again shortly or use get_write_status_wrapper.")
+    return prefetch_scheduler.fetch("list_bookings_wrapper", {"user_id": user_id})
+
+def _list_bookings(user_id: str) -> dict:
     tool_name = "list-bookings"
     if tool_name not in tool_registry:
         return {"error": f"Tool '{tool_name}' not found in registry. Available: {list(tool_registry.keys())}"}
@@ -338,6 +508,23 @@ def search_user_by_email_wrapper(email: str) -> dict:
     except Exception as e:
         return {"error": f"Failed to search user by email: {str(e)}"}
 
+def get_write_status_wrapper(reference: str) -> dict:
+    """Check the status of a queued user registration or booking.
+    
+    Args:
+        reference: Provisional reference returned by create_user_wrapper or book_hotel_wrapper
+    
+    Returns:
+        Dictionary with status ('pending', 'inflight', 'committed' or 'failed') and,
+        once committed, the result containing user_id or booking_id
+    """
+    if not write_behind:
+        return {"error": "Write-behind pipeline is disabled; writes complete synchronously"}
+    try:
+        return write_behind.status(reference)
+    except Exception as e:
+        return {"error": f"Failed to get write status: {str(e)}"}
+
 # ----------------------------
 # Define direct HTTP tool for Places Search
 # ----------------------------
@@ -351,6 +538,9 @@ def places_search_tool(query: str) -> dict:
         A dictionary containing search results with status and places data.
         Example: {'status': 'success', 'places': [...]} or {'status': 'error', 'message': '...'}
     """
+    return prefetch_scheduler.fetch("places_search_tool", {"query": query})
+
+def _places_search(query: str) -> dict:
     try:
         res = requests.post(MAPS_SERVICE_URL, json={"query": query})
         res.raise_for_status()
@@ -358,12 +548,181 @@ def places_search_tool(query: str) -> dict:
     except requests.exceptions.RequestException as e:
         return {"status": "error", "message": f"Failed to search places: {str(e)}"}
 
+# ----------------------------
+# Speculative prefetch of likely follow-up lookups
+# ----------------------------
+try:
+    from .prefetch import PrefetchScheduler, prefetch_scope
+except ImportError:
+    from prefetch import PrefetchScheduler, prefetch_scope
+
+PREFETCH_PLACE_CATEGORIES = ["restaurants", "attractions", "nightlife"]
+
+prefetch_scheduler = PrefetchScheduler({
+    "places_search_tool": _places_search,
+    "list_bookings_wrapper": _list_bookings,
+})
+
+def _prefetch_places_for_location(args, result):
+    location = args.get("location")
+    if not location or not parse_tool_rows(result):
+        return []
+    return [("places_search_tool", {"query": f"{c} in {location}"}) for c in PREFETCH_PLACE_CATEGORIES]
+
+def _prefetch_bookings_for_user(args, result):
+    rows = parse_tool_rows(result)
+    if len(rows) != 1 or not rows[0].get("user_id"):
+        return []
+    if write_behind and write_behind.journal.pending_bookings(str(rows[0]["user_id"])):
+        # A queued booking would be missing from the warmed list once it commits
+        return []
+    return [("list_bookings_wrapper", {"user_id": str(rows[0]["user_id"])})]
+
+prefetch_scheduler.add_rule("search_hotels_by_location_wrapper", _prefetch_places_for_location)
+prefetch_scheduler.add_rule("search_user_by_name_wrapper", _prefetch_bookings_for_user)
+prefetch_scheduler.add_rule("search_user_by_email_wrapper", _prefetch_bookings_for_user)
+
+def prefetch_after_tool_callback(tool, args, tool_context, tool_response):
+    """ADK after_tool_callback: feed completed tool calls to the prefetch scheduler"""
+    if tool.name == "book_hotel_wrapper" and args.get("user_id"):
+        # A new booking makes any warmed booking list stale
+        user_id, _ = _resolve_user_reference(str(args["user_id"]))
+        if user_id:
+            prefetch_scheduler.invalidate("list_bookings_wrapper", {"user_id": str(user_id)})
+        else:
+            prefetch_scheduler.invalidate_tool("list_bookings_wrapper")
+        return None
+    session = getattr(tool_context, "session", None)
+    session_id = prefetch_scope.get() or (session.id if session else "default")
+    prefetch_scheduler.observe(session_id, tool.name, args, tool_response)
+    return None
+
+# ----------------------------
+# Composite multi-destination itinerary tool
+# ----------------------------
+ITINERARY_MAX_WORKERS = int(os.getenv("ITINERARY_MAX_WORKERS", "12"))
+DEFAULT_PLACE_CATEGORIES = ["attractions", "restaurants"]
+PRICE_TIER_ORDER = {"Midscale": 1, "Upper Midscale": 2, "Upscale": 3, "Upper Upscale": 4, "Luxury": 5}
+
+def _rank_hotels(location_rows: list, preferred_rows: list) -> list:
+    """Merge Cloud SQL location results with BigQuery traveler-type matches and rank them.
+
+    Hotels matching the traveler type come first (by rating), then the rest by price tier.
+    """
+    preferred = {str(row.get("name", "")).lower(): row for row in preferred_rows}
+    ranked = []
+    for row in location_rows:
+        match = preferred.pop(str(row.get("name", "")).lower(), None)
+        hotel = dict(row)
+        hotel["matches_traveler_type"] = match is not None
+        if match:
+            hotel["rating"] = match.get("rating")
+            hotel["avg_price_per_night"] = match.get("avg_price_per_night")
+        ranked.append(hotel)
+    # BigQuery-only hotels still count as recommendations for this destination
+    for row in preferred.values():
+        hotel = dict(row)
+        hotel["matches_traveler_type"] = True
+        ranked.append(hotel)
+    ranked.sort(key=lambda h: (
+        not h["matches_traveler_type"],
+        -float(h.get("rating") or 0),
+        PRICE_TIER_ORDER.get(h.get("price_tier"), 99),
+    ))
+    return ranked
+
+def _rank_places(result: dict) -> list:
+    if not isinstance(result, dict) or result.get("status") != "success":
+        return []
+    places = result.get("data", {}).get("results", [])
+    return sorted(places, key=lambda p: -float(p.get("rating") or 0))
+
+def plan_itinerary_wrapper(destinations: list[str], traveler_type: str = "", interests: list[str] = None) -> dict:
+    """Plan a multi-destination trip in one call: hotels and places for every city.
+    
+    Runs the hotel location search, the traveler-type search and the places searches
+    for all destinations concurrently, then merges them into one ranked result.
+    
+    Args:
+        destinations: Cities in travel order, e.g. ["Zurich", "Goa"]
+        traveler_type: Optional traveler type ('family' or 'couple') used to rank hotels
+        interests: Optional place categories, e.g. ["restaurants", "nightlife"]. Defaults to attractions and restaurants
+    
+    Returns:
+        Dictionary with one entry per destination holding ranked hotels and places, plus any lookup errors
+    """
+    destinations = [d.strip() for d in destinations or [] if d and d.strip()]
+    if not destinations:
+        return {"error": "At least one destination is required"}
+    categories = [c.strip() for c in interests or [] if c and c.strip()] or DEFAULT_PLACE_CATEGORIES
+
+    with ThreadPoolExecutor(max_workers=ITINERARY_MAX_WORKERS) as pool:
+        hotel_futures = {d: pool.submit(search_hotels_by_location_wrapper, d) for d in destinations}
+        # The traveler-type query is not location scoped, so one call serves every destination
+        preferred_future = pool.submit(search_hotels_by_traveler_type_wrapper, traveler_type) if traveler_type else None
+        place_futures = {
+            (d, c): pool.submit(places_search_tool, f"{c} in {d}") for d in destinations for c in categories
+        }
+
+        errors = []
+        def collect(future, label):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"error": str(e)}
+            if isinstance(result, dict) and ("error" in result or result.get("status") == "error"):
+                errors.append({"lookup": label, "error": result.get("error") or result.get("message")})
+            return result
+
+        preferred_rows = parse_tool_rows(collect(preferred_future, f"traveler_type:{traveler_type}")) if preferred_future else []
+        itinerary = []
+        for d in destinations:
+            location_rows = parse_tool_rows(collect(hotel_futures[d], f"hotels:{d}"))
+            local_preferred = [
+                row for row in preferred_rows if d.lower() in str(row.get("location", "")).lower()
+            ]
+            itinerary.append({
+                "destination": d,
+                "hotels": _rank_hotels(location_rows, local_preferred),
+                "places": {c: _rank_places(collect(place_futures[(d, c)], f"places:{c} in {d}")) for c in categories},
+            })
+
+    response = {"status": "success" if not errors else "partial_success", "itinerary": itinerary}
+    if errors:
+        response["errors"] = errors
+    return response
+
+# ----------------------------
+# Conversation history compaction
+# ----------------------------
+try:
+    from .history_compaction import HistoryCompactor
+except ImportError:
+    from history_compaction import HistoryCompactor
+
+history_compactor = HistoryCompactor()
+
+def get_cached_result_wrapper(result_ref: str, tool_context: ToolContext) -> dict:
+    """Fetch the full output of an earlier tool call that was compacted out of the conversation.
+    
+    Args:
+        result_ref: The result_ref from a tool output marked 'compacted'
+    
+    Returns:
+        Dictionary with the original tool output, or an error if it has expired from the cache
+    """
+    # Scoped to the calling session so one user's compacted results never leak to another
+    payload = history_compactor.cache.get(tool_context.session.id, result_ref)
+    if payload is None:
+        return {"error": f"Result '{result_ref}' is no longer cached; repeat the original search instead"}
+    return {"status": "success", "result_ref": result_ref, "result": payload}
+
 # ----------------------------
 # Create FunctionTools with wrapper functions
 # ----------------------------
 hotel_tools = [
     FunctionTool(func=create_user_wrapper),
-    FunctionTool(func=search_hotels_wrapper),  # Keep this as a general search function
+    FunctionTool(func=search_hotels_wrapper),  # Ranked search across name, location, price tier and attributes
     FunctionTool(func=search_hotels_by_name_wrapper),
     FunctionTool(func=search_hotels_by_location_wrapper),
     FunctionTool(func=search_hotels_by_traveler_type_wrapper),
@@ -371,14 +730,17 @@ hotel_tools = [
     FunctionTool(func=list_bookings_wrapper),
     FunctionTool(func=search_user_by_name_wrapper),
     FunctionTool(func=search_user_by_email_wrapper),
+    FunctionTool(func=get_write_status_wrapper),
+    FunctionTool(func=get_cached_result_wrapper),
 ]
 
 places_tool = FunctionTool(func=places_search_tool)
+itinerary_tool = FunctionTool(func=plan_itinerary_wrapper)
 
 # ----------------------------
 # Combine all tools
 # ----------------------------
-all_tools = hotel_tools + [places_tool]
+all_tools = hotel_tools + [places_tool, itinerary_tool]
 
 print(f"✅ Created {len(all_tools)} ADK-compatible tools")
 
@@ -397,11 +759,17 @@ root_agent = Agent(
         "- search_hotels_by_name_wrapper for specific hotel names "
         "- search_hotels_by_location_wrapper for location-based searches (results sorted by price) "
         "- search_hotels_by_traveler_type_wrapper for family/couple preferences (uses BigQuery data) "
-        "- search_hotels_wrapper as a general search function "
+        "- search_hotels_wrapper for one ranked free-text search across name, location, price tier and family/couple suitability "
         "Step 3: For bookings, use book_hotel_wrapper with the user_id from registration/search. "
+        "Registrations and bookings may return status 'pending' with a reference; a pending user reference can be used as user_id, "
+        "and get_write_status_wrapper confirms the final user_id or booking_id. "
         "Step 4: Use list_bookings_wrapper to show a user's booking history with full details. "
-        "Step 5: For places/attractions, use places_search_tool for restaurants, nightlife, etc. "
+        "Step 5: For places/attractions, use places_search_tool for restaurants, nightlife, etc., phrasing the query as '<category> in <city>'. "
+        "For trips covering several cities (e.g. 'Zurich then Goa'), call plan_itinerary_wrapper once with all destinations, "
+        "the traveler type and interests instead of searching each city separately. "
         "Always provide helpful information and guide users through the booking process step by step."
     ),
     tools=all_tools,
+    before_model_callback=history_compactor.before_model_callback,
+    after_tool_callback=prefetch_after_tool_callback,
 )
\ No newline at end of file
@@ -37,6 +37,14 @@ gcloud services enable \
     sqladmin.googleapis.com \
     --project=$PROJECT_ID
 
+# ----------------------------
+# Bundle tools.yaml
+# ----------------------------
+# The image is built from this directory; TOOL_BACKEND=postgres reads the
+# toolbox statements from a tools.yaml next to pg_backend.py
+cp ../../mcp-toolbox/tools.yaml ./tools.yaml
+trap 'rm -f ./tools.yaml' EXIT
+
 # ----------------------------
 # Deploy to Cloud Run
 # ----------------------------
@@ -48,7 +56,7 @@ gcloud run deploy $SERVICE_NAME \
     --project $PROJECT_ID \
     --allow-unauthenticated \
     --region $REGION \
-    --set-env-vars="TOOLBOX_URL=$TOOLBOX_URL,MAPS_SERVICE_URL=$MAPS_SERVICE_URL,SERVER_TYPE=fastapi" \
+    --set-env-vars="TOOLBOX_URL=$TOOLBOX_URL,MAPS_SERVICE_URL=$MAPS_SERVICE_URL,SERVER_TYPE=fastapi,ADMISSION_TRUSTED_PROXY_HOPS=1" \
     --memory=2Gi \
     --cpu=2 \
     --max-instances=10 \
@@ -0,0 +1,189 @@
+import os
+import copy
+import json
+import hashlib
+from collections import OrderedDict
+
+# ----------------------------
+# Conversation history compaction
+# ----------------------------
+# Runs as the agent's before_model_callback. The session keeps every event,
+# but the prompt sent to the model is rebuilt each turn; once that prompt
+# passes HISTORY_TOKEN_BUDGET, the oldest tool outputs are replaced with a
+# compact summary and a result_ref into an in-memory cache (retrievable with
+# get_cached_result_wrapper). Facts such as user_id, hotel_id and dates are
+# collected from tool calls and pinned into the system instruction so they
+# survive compaction.
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "8000"))
+HISTORY_KEEP_RECENT = int(os.getenv("HISTORY_KEEP_RECENT", "6"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+
+PINNED_KEYS = ("user_id", "email", "hotel_id", "booking_id", "reference",
+               "check_in", "check_out", "guests")
+
+# Rough chars-per-token ratio for Gemini; only used to compare against the budget
+_CHARS_PER_TOKEN = 4
+_SUMMARY_SAMPLE = 5
+_COMPACTED_MARKER = "result_ref"
+
+
+class ResultCache:
+    """LRU cache of full tool results keyed by session and content hash.
+
+    Results can hold personal data (user lookups, booking lists), so a
+    result_ref only resolves within the session that produced it.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def put(self, session_id: str, payload) -> str:
+        encoded = json.dumps(payload, sort_keys=True, default=str)
+        ref = "res_" + hashlib.sha1(encoded.encode()).hexdigest()[:12]
+        key = (session_id, ref)
+        self._entries[key] = payload
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return ref
+
+    def get(self, session_id: str, ref: str):
+        key = (session_id, ref)
+        payload = self._entries.get(key)
+        if payload is not None:
+            self._entries.move_to_end(key)
+        return payload
+
+
+def _part_size(part) -> int:
+    size = len(getattr(part, "text", None) or "")
+    call = getattr(part, "function_call", None)
+    if call is not None:
+        size += len(json.dumps(call.args or {}, default=str))
+    response = getattr(part, "function_response", None)
+    if response is not None:
+        size += len(json.dumps(response.response or {}, default=str))
+    return size
+
+
+def estimate_tokens(contents) -> int:
+    return sum(_part_size(part) for content in contents for part in (content.parts or [])) // _CHARS_PER_TOKEN
+
+
+def _rows(response):
+    """Extract result rows from a tool response (ADK wraps non-dict returns as {'result': ...})"""
+    value = response.get("result", response) if isinstance(response, dict) else response
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if isinstance(value, dict):
+        for key in ("results", "itinerary", "data"):
+            if isinstance(value.get(key), (list, dict)):
+                return _rows(value[key])
+        return None
+    return value if isinstance(value, list) else None
+
+
+def summarize_response(name: str, response, ref: str) -> dict:
+    summary = {_COMPACTED_MARKER: ref, "tool": name, "compacted": True}
+    rows = _rows(response)
+    if rows is not None:
+        summary["row_count"] = len(rows)
+        labels = [
+            row.get("name") or row.get("hotel_name") or row.get("destination")
+            for row in rows[:_SUMMARY_SAMPLE] if isinstance(row, dict)
+        ]
+        summary["sample"] = [label for label in labels if label]
+    elif isinstance(response, dict):
+        # Small structured results (status checks, errors) keep their scalar fields
+        summary.update({k: v for k, v in response.items() if isinstance(v, (str, int, float, bool))})
+    return summary
+
+
+def _collect_facts(mapping, facts: dict):
+    if isinstance(mapping, str):
+        try:
+            mapping = json.loads(mapping)
+        except ValueError:
+            return
+    if isinstance(mapping, list):
+        # Only single-row results identify one entity (e.g. a user lookup)
+        if len(mapping) == 1:
+            _collect_facts(mapping[0], facts)
+        return
+    if not isinstance(mapping, dict):
+        return
+    for key in PINNED_KEYS:
+        if mapping.get(key) not in (None, ""):
+            facts[key] = mapping[key]
+    if "result" in mapping:
+        _collect_facts(mapping["result"], facts)
+
+
+class HistoryCompactor:
+    """Bounds prompt size by summarising old tool outputs and pinning key facts"""
+
+    def __init__(self, budget: int = HISTORY_TOKEN_BUDGET, keep_recent: int = HISTORY_KEEP_RECENT,
+                 cache: ResultCache = None):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.cache = cache or ResultCache()
+        self.last_stats = {}
+
+    def extract_facts(self, contents) -> dict:
+        facts = {}
+        for content in contents:
+            for part in content.parts or []:
+                call = getattr(part, "function_call", None)
+                if call is not None:
+                    _collect_facts(call.args or {}, facts)
+                response = getattr(part, "function_response", None)
+                if response is not None and not (response.response or {}).get(_COMPACTED_MARKER):
+                    _collect_facts(response.response or {}, facts)
+        return facts
+
+    def compact(self, contents, session_id: str) -> list:
+        """Return contents with the oldest tool outputs summarised until under budget"""
+        before = tokens = estimate_tokens(contents)
+        compacted = 0
+        contents = list(contents)
+        if tokens > self.budget:
+            for i in range(max(len(contents) - self.keep_recent, 0)):
+                if tokens <= self.budget:
+                    break
+                content = contents[i]
+                if not any(getattr(p, "function_response", None) is not None for p in content.parts or []):
+                    continue
+                # Copy before editing: contents may alias the session's stored events
+                content = copy.deepcopy(content)
+                for part in content.parts:
+                    response = getattr(part, "function_response", None)
+                    if response is None or (response.response or {}).get(_COMPACTED_MARKER):
+                        continue
+                    old_size = _part_size(part)
+                    ref = self.cache.put(session_id, response.response)
+                    response.response = summarize_response(response.name, response.response, ref)
+                    tokens -= (old_size - _part_size(part)) // _CHARS_PER_TOKEN
+                    compacted += 1
+                contents[i] = content
+        self.last_stats = {"tokens_before": before, "tokens_after": tokens, "compacted_parts": compacted}
+        return contents
+
+    def before_model_callback(self, callback_context, llm_request):
+        """ADK before_model_callback: compact llm_request in place and let the model call proceed"""
+        facts = dict(callback_context.state.get("pinned_facts") or {})
+        facts.update(self.extract_facts(llm_request.contents))
+        if facts:
+            callback_context.state["pinned_facts"] = facts
+        llm_request.contents = self.compact(llm_request.contents, callback_context.session.id)
+        if facts:
+            pinned = ", ".join(f"{k}={v}" for k, v in facts.items())
+            llm_request.append_instructions([
+                f"Pinned facts from earlier in this conversation: {pinned}. "
+                "Tool outputs marked 'compacted' can be fetched in full with get_cached_result_wrapper(result_ref)."
+            ])
+        return None
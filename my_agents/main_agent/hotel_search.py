@@ -0,0 +1,262 @@
+import os
+import re
+import math
+import time
+import threading
+from collections import defaultdict
+
+# ----------------------------
+# Unified in-process hotel search (BM25 over Cloud SQL + BigQuery attributes)
+# ----------------------------
+# Hotels are indexed from the Cloud SQL catalogue (name, location, price tier)
+# and enriched with BigQuery attributes (kid_friendly, romantic, rating,
+# avg_price_per_night). Attributes and price tiers are indexed as extra
+# keyword tokens, so "romantic luxury goa" matches without a dedicated tool.
+# Refreshes diff the source rows against the index and only re-index
+# documents that changed.
+
+HOTEL_INDEX_TTL_SECONDS = float(os.getenv("HOTEL_INDEX_TTL_SECONDS", "300"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Per-field boosts applied to term frequencies (a simplified BM25F)
+FIELD_WEIGHTS = {
+    "name": 2.0,
+    "location": 1.5,
+    "price_tier": 1.0,
+    "attributes": 1.0,
+}
+
+ATTRIBUTE_KEYWORDS = {
+    "kid_friendly": ["family", "families", "kid", "kids", "children", "child"],
+    "kitchen_attached": ["kitchen", "family", "families"],
+    "romantic": ["romantic", "couple", "couples", "honeymoon"],
+}
+
+PRICE_TIER_KEYWORDS = {
+    "Midscale": ["budget", "cheap", "affordable", "economy"],
+    "Upper Midscale": ["affordable", "value"],
+    "Upscale": ["premium"],
+    "Upper Upscale": ["premium", "deluxe"],
+    "Luxury": ["luxury", "luxurious", "deluxe", "premium"],
+}
+
+# Weight of the normalised rating (0-5) added on top of the text score
+RATING_WEIGHT = 0.3
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text) -> list:
+    return _TOKEN_RE.findall(str(text or "").lower())
+
+
+def _truthy(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "t", "yes")
+    return bool(value)
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring supporting incremental upsert and removal"""
+
+    def __init__(self, field_weights: dict = FIELD_WEIGHTS):
+        self.field_weights = field_weights
+        self.postings = defaultdict(dict)   # term -> {doc_id: weighted tf}
+        self.doc_terms = {}                 # doc_id -> {term: weighted tf}
+        self.doc_lengths = {}
+        self._total_length = 0.0
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def upsert(self, doc_id, fields: dict):
+        self.remove(doc_id)
+        terms = defaultdict(float)
+        for field, tokens in fields.items():
+            weight = self.field_weights.get(field, 1.0)
+            for token in tokens:
+                terms[token] += weight
+        for term, tf in terms.items():
+            self.postings[term][doc_id] = tf
+        self.doc_terms[doc_id] = dict(terms)
+        length = sum(terms.values())
+        self.doc_lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            docs = self.postings[term]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+        self._total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query_terms: list) -> dict:
+        """Return {doc_id: bm25 score} for documents matching any query term"""
+        n = len(self.doc_terms)
+        if not n:
+            return {}
+        avg_length = self._total_length / n or 1.0
+        scores = defaultdict(float)
+        for term in set(query_terms):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+
+class HotelSearchEngine:
+    """Ranked hotel search over the merged Cloud SQL and BigQuery hotel catalogue.
+
+    ``load_hotels`` and ``load_attributes`` are callables returning lists of row
+    dicts and raising when a load fails. The index is built lazily and refreshed
+    in the background once it is older than ``ttl`` seconds, so queries never
+    wait on the upstream fetch after the first build. A failed or empty load
+    keeps the data from the previous refresh.
+    """
+
+    def __init__(self, load_hotels, load_attributes=None, ttl: float = HOTEL_INDEX_TTL_SECONDS):
+        self.load_hotels = load_hotels
+        self.load_attributes = load_attributes
+        self.ttl = ttl
+        self.index = BM25Index()
+        self.hotels = {}
+        self._signatures = {}
+        self._attribute_rows = []
+        self._built_at = None
+        self._refresh_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._refreshing = False
+
+    # ----------------------------
+    # Index maintenance
+    # ----------------------------
+    def _merge(self, hotel_rows: list, attribute_rows: list) -> dict:
+        by_id = {str(row.get("hotel_id")): row for row in attribute_rows if row.get("hotel_id") is not None}
+        by_name = {str(row.get("name", "")).lower(): row for row in attribute_rows}
+        merged = {}
+        for row in hotel_rows:
+            hotel_id = str(row.get("id", row.get("hotel_id")))
+            attributes = by_id.get(hotel_id) or by_name.get(str(row.get("name", "")).lower()) or {}
+            merged[hotel_id] = {
+                "hotel_id": hotel_id,
+                "name": row.get("name"),
+                "location": row.get("location") or attributes.get("location"),
+                "price_tier": row.get("price_tier"),
+                "rating": attributes.get("rating"),
+                "avg_price_per_night": attributes.get("avg_price_per_night"),
+                "kid_friendly": _truthy(attributes.get("kid_friendly")),
+                "kitchen_attached": _truthy(attributes.get("kitchen_attached")),
+                "romantic": _truthy(attributes.get("romantic")),
+            }
+        return merged
+
+    @staticmethod
+    def _fields(hotel: dict) -> dict:
+        attributes = []
+        for flag, keywords in ATTRIBUTE_KEYWORDS.items():
+            if hotel.get(flag):
+                attributes.extend(keywords)
+        attributes.extend(PRICE_TIER_KEYWORDS.get(hotel.get("price_tier"), []))
+        return {
+            "name": tokenize(hotel.get("name")),
+            "location": tokenize(hotel.get("location")),
+            "price_tier": tokenize(hotel.get("price_tier")),
+            "attributes": attributes,
+        }
+
+    def _load_attribute_rows(self) -> list:
+        # BigQuery attributes only enrich ranking; reuse the last good load rather
+        # than re-indexing every hotel without its rating and flags
+        if not self.load_attributes:
+            return []
+        try:
+            rows = self.load_attributes()
+        except Exception as e:
+            print(f"⚠️ Failed to load hotel attributes, keeping the previous ones: {e}")
+            return self._attribute_rows
+        if rows:
+            self._attribute_rows = rows
+        return self._attribute_rows
+
+    def refresh(self) -> dict:
+        """Fetch the catalogue and apply only the differences to the index.
+
+        Raises if the catalogue cannot be loaded, leaving the index unchanged.
+        """
+        hotel_rows = self.load_hotels()
+        if not hotel_rows:
+            raise RuntimeError("Hotel catalogue load returned no rows")
+        attribute_rows = self._load_attribute_rows()
+        merged = self._merge(hotel_rows, attribute_rows)
+        added = updated = 0
+        with self._refresh_lock:
+            for hotel_id, hotel in merged.items():
+                signature = tuple(sorted(hotel.items()))
+                previous = self._signatures.get(hotel_id)
+                if previous == signature:
+                    continue
+                self.index.upsert(hotel_id, self._fields(hotel))
+                self.hotels[hotel_id] = hotel
+                self._signatures[hotel_id] = signature
+                if previous is None:
+                    added += 1
+                else:
+                    updated += 1
+            removed = [hotel_id for hotel_id in self.hotels if hotel_id not in merged]
+            for hotel_id in removed:
+                self.index.remove(hotel_id)
+                del self.hotels[hotel_id]
+                del self._signatures[hotel_id]
+            self._built_at = time.monotonic()
+        return {"added": added, "updated": updated, "removed": len(removed), "total": len(self.hotels)}
+
+    def _refresh_in_background(self):
+        with self._build_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ Hotel index refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="hotel-index-refresh", daemon=True).start()
+
+    def ensure_fresh(self):
+        if self._built_at is None:
+            # Concurrent first queries wait for one build instead of each fetching the catalogue
+            with self._build_lock:
+                if self._built_at is None:
+                    self.refresh()
+        elif time.monotonic() - self._built_at > self.ttl:
+            self._refresh_in_background()
+
+    # ----------------------------
+    # Query
+    # ----------------------------
+    def search(self, query: str, limit: int = 10) -> list:
+        self.ensure_fresh()
+        terms = tokenize(query)
+        with self._refresh_lock:
+            scores = self.index.search(terms)
+            results = []
+            for hotel_id, score in scores.items():
+                hotel = self.hotels[hotel_id]
+                rating = float(hotel.get("rating") or 0)
+                results.append(dict(hotel, score=round(score + RATING_WEIGHT * rating / 5, 4)))
+        results.sort(key=lambda h: -h["score"])
+        return results[:limit]
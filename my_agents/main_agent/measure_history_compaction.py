@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Measure prompt size and latency per turn over a scripted 40-turn session.
+
+Offline (default): replays a synthetic trip-planning history with realistic
+hotel and places payloads and reports the estimated prompt tokens per turn
+with and without compaction, plus the compaction overhead.
+
+Live (--live): drives root_agent through an in-memory ADK runner and reports
+the model's prompt_token_count and wall time per turn. Run it twice, with and
+without --no-compaction, to compare:
+
+    python measure_history_compaction.py --live
+    python measure_history_compaction.py --live --no-compaction
+"""
+import time
+import asyncio
+import argparse
+
+from google.genai import types
+
+from history_compaction import HistoryCompactor, estimate_tokens
+
+TURNS = 40
+
+SCRIPT = [
+    "Hi, I'm Priya Sharma, email priya@example.com. Can you find my account?",
+    "Show me hotels in Goa",
+    "Which of those are good for couples?",
+    "What restaurants are near Calangute?",
+    "Any nightlife in North Goa?",
+    "Show me hotels in Zurich",
+    "Which Zurich hotels are good for families?",
+    "What attractions are there in Zurich?",
+    "Book W Goa from 2024-12-18 to 2024-12-23 for 2 guests",
+    "List my bookings",
+]
+
+
+def _hotel_rows(city: str, count: int = 10) -> list:
+    tiers = ["Midscale", "Upscale", "Upper Upscale", "Luxury"]
+    return [
+        {"id": i, "name": f"{city} Hotel {i}", "location": f"Area {i}, {city}",
+         "price_tier": tiers[i % len(tiers)], "checkin_date": "2024-12-18",
+         "checkout_date": "2024-12-23", "booked": "0"}
+        for i in range(count)
+    ]
+
+
+def _place_rows(query: str, count: int = 20) -> dict:
+    return {"status": "success", "data": {"results": [
+        {"name": f"{query} #{i}", "rating": 4.0 + (i % 10) / 10,
+         "address": f"{i} Beach Road, {query}", "location": {"latitude": 15.5, "longitude": 73.8},
+         "types": ["restaurant", "food", "point_of_interest", "establishment"]}
+        for i in range(count)
+    ]}}
+
+
+def _scripted_exchange(turn: int) -> list:
+    """One user turn plus the tool call/response and reply the agent would produce"""
+    message = SCRIPT[turn % len(SCRIPT)]
+    city = "Zurich" if "Zurich" in message else "Goa"
+    if "account" in message:
+        name, args, response = "search_user_by_email_wrapper", {"email": "priya@example.com"}, {
+            "result": [{"user_id": "7f1c2a9e-1111-4e3b-9c55-2d8f0d1e9a10", "name": "Priya Sharma",
+                        "email": "priya@example.com", "phone": "+91-9000000000"}]}
+    elif "Book" in message:
+        name, args, response = "book_hotel_wrapper", {
+            "user_id": "7f1c2a9e-1111-4e3b-9c55-2d8f0d1e9a10", "hotel_id": "12",
+            "check_in": "2024-12-18", "check_out": "2024-12-23", "guests": 2}, {
+            "status": "pending", "reference": f"BKG-{turn:012d}"}
+    elif "restaurants" in message or "nightlife" in message or "attractions" in message:
+        name, args, response = "places_search_tool", {"query": message}, _place_rows(city)
+    elif "bookings" in message:
+        name, args, response = "list_bookings_wrapper", {"user_id": "7f1c2a9e-1111-4e3b-9c55-2d8f0d1e9a10"}, {
+            "result": _hotel_rows(city, 3)}
+    else:
+        name, args, response = "search_hotels_by_location_wrapper", {"location": city}, {
+            "result": _hotel_rows(city)}
+    return [
+        types.Content(role="user", parts=[types.Part(text=message)]),
+        types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(name=name, args=args))]),
+        types.Content(role="user", parts=[types.Part(
+            function_response=types.FunctionResponse(name=name, response=response))]),
+        types.Content(role="model", parts=[types.Part(text=f"Here is what I found for: {message}")]),
+    ]
+
+
+def run_offline(compactor: HistoryCompactor):
+    print(f"{'turn':>4}{'raw tokens':>12}{'compacted':>12}{'parts':>8}{'overhead ms':>13}")
+    history = []
+    for turn in range(TURNS):
+        history.extend(_scripted_exchange(turn))
+        start = time.perf_counter()
+        compacted = compactor.compact(history, "offline")
+        compactor.extract_facts(history)
+        overhead = (time.perf_counter() - start) * 1000
+        print(f"{turn + 1:>4}{estimate_tokens(history):>12}{estimate_tokens(compacted):>12}"
+              f"{compactor.last_stats['compacted_parts']:>8}{overhead:>13.2f}")
+
+
+async def run_live():
+    from google.adk.runners import InMemoryRunner
+    from agent import root_agent
+
+    runner = InMemoryRunner(agent=root_agent, app_name="compaction_measure")
+    session = await runner.session_service.create_session(app_name="compaction_measure", user_id="measure")
+    print(f"{'turn':>4}{'prompt tokens':>15}{'latency s':>11}")
+    for turn in range(TURNS):
+        message = types.Content(role="user", parts=[types.Part(text=SCRIPT[turn % len(SCRIPT)])])
+        prompt_tokens = 0
+        start = time.perf_counter()
+        async for event in runner.run_async(user_id="measure", session_id=session.id, new_message=message):
+            usage = getattr(event, "usage_metadata", None)
+            if usage and usage.prompt_token_count:
+                prompt_tokens = max(prompt_tokens, usage.prompt_token_count)
+        print(f"{turn + 1:>4}{prompt_tokens:>15}{time.perf_counter() - start:>11.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--live", action="store_true", help="Run the real agent (needs Gemini credentials)")
+    parser.add_argument("--no-compaction", action="store_true", help="Disable compaction for a baseline")
+    parser.add_argument("--budget", type=int, help="Override HISTORY_TOKEN_BUDGET")
+    args = parser.parse_args()
+
+    if args.live:
+        import agent
+        if args.no_compaction:
+            agent.history_compactor.budget = float("inf")
+        elif args.budget:
+            agent.history_compactor.budget = args.budget
+        asyncio.run(run_live())
+    else:
+        compactor = HistoryCompactor()
+        if args.no_compaction:
+            compactor.budget = float("inf")
+        elif args.budget:
+            compactor.budget = args.budget
+        run_offline(compactor)
+
+
+if __name__ == "__main__":
+    main()
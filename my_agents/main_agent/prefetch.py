@@ -0,0 +1,242 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------------------
+# Speculative prefetch of likely follow-up lookups
+# ----------------------------
+# After a tool call completes, registered rules predict the next lookups
+# (e.g. places in the city just searched, bookings for the user just found)
+# and run them in the background. Tools that read through ``fetch`` are
+# served from the warmed cache, joining the prefetch if it is still in
+# flight. Prefetches beyond the concurrency budget are dropped rather than
+# queued. Each session has a cancel flag that is set when the session ends
+# (see ``prefetch_scope``) or idles out; a prefetch checks it before calling
+# its loader and drops its result if the flag was set meanwhile. Results
+# that completed in time stay cached until their TTL.
+
+PREFETCH_MAX_CONCURRENCY = int(os.getenv("PREFETCH_MAX_CONCURRENCY", "4"))
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", "300"))
+PREFETCH_SESSION_IDLE_SECONDS = float(os.getenv("PREFETCH_SESSION_IDLE_SECONDS", "900"))
+
+# Servers that treat one request as one session set this for the request and
+# call cancel_session with the same id on teardown; it overrides the ADK session id.
+prefetch_scope = contextvars.ContextVar("prefetch_scope", default=None)
+
+_CANCELLED = object()
+
+
+def cache_key(tool_name: str, args: dict) -> tuple:
+    """Normalise string arguments so 'Restaurants in  Goa' and 'restaurants in goa' share an entry"""
+    normalised = []
+    for key, value in sorted(args.items()):
+        if isinstance(value, str):
+            value = " ".join(value.lower().split())
+        normalised.append((key, value))
+    return (tool_name, tuple(normalised))
+
+
+class _Entry:
+    __slots__ = ("future", "session_id", "expires_at", "used")
+
+    def __init__(self, future, session_id, expires_at):
+        self.future = future
+        self.session_id = session_id
+        self.expires_at = expires_at
+        self.used = False
+
+
+class PrefetchScheduler:
+    """Background prefetcher with a concurrency budget and per-session cancellation.
+
+    ``loaders`` maps a tool name to the uncached function that performs the lookup.
+    Rules are ``fn(args, result) -> [(tool_name, args), ...]`` registered per observed tool.
+    """
+
+    def __init__(self, loaders: dict, max_concurrency: int = PREFETCH_MAX_CONCURRENCY,
+                 ttl: float = PREFETCH_TTL_SECONDS, session_idle: float = PREFETCH_SESSION_IDLE_SECONDS):
+        self.loaders = loaders
+        self.max_concurrency = max_concurrency
+        self.ttl = ttl
+        self.session_idle = session_idle
+        self.rules = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._inflight = 0
+        self._session_seen = {}
+        self._cancel_flags = {}
+        self.metrics = {
+            "issued": 0, "dropped_budget": 0, "completed": 0, "failed": 0,
+            "hits": 0, "misses": 0, "wasted": 0, "cancelled": 0,
+        }
+
+    def add_rule(self, tool_name: str, rule):
+        self.rules.setdefault(tool_name, []).append(rule)
+
+    # ----------------------------
+    # Scheduling
+    # ----------------------------
+    def observe(self, session_id: str, tool_name: str, args: dict, result):
+        """Called after each completed tool call; schedules predicted follow-ups"""
+        self._touch(session_id)
+        for rule in self.rules.get(tool_name, []):
+            try:
+                predictions = rule(args, result) or []
+            except Exception as e:
+                print(f"⚠️ Prefetch rule for {tool_name} failed: {e}")
+                continue
+            for target, target_args in predictions:
+                self._schedule(session_id, target, target_args)
+
+    def _schedule(self, session_id: str, tool_name: str, args: dict):
+        key = cache_key(tool_name, args)
+        loader = self.loaders[tool_name]
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry.expires_at > time.monotonic() and not entry.future.cancelled():
+                return
+            if self._inflight >= self.max_concurrency:
+                self.metrics["dropped_budget"] += 1
+                return
+            cancelled = self._cancel_flags.setdefault(session_id, threading.Event())
+            self._inflight += 1
+            self.metrics["issued"] += 1
+            future = self._pool.submit(_run_unless_cancelled, cancelled, loader, args)
+            self._cache[key] = _Entry(future, session_id, time.monotonic() + self.ttl)
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        with self._lock:
+            self._inflight -= 1
+            if future.cancelled() or (future.exception() is None and future.result() is _CANCELLED):
+                self.metrics["cancelled"] += 1
+                return
+            failed = future.exception() is not None or _is_error(future.result())
+            self.metrics["failed" if failed else "completed"] += 1
+            if failed:
+                # Never serve a failed prefetch; the real call will retry
+                for key, entry in list(self._cache.items()):
+                    if entry.future is future:
+                        del self._cache[key]
+
+    # ----------------------------
+    # Read-through
+    # ----------------------------
+    def fetch(self, tool_name: str, args: dict):
+        """Return a prefetched result if one is cached or in flight, else call the loader"""
+        key = cache_key(tool_name, args)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry.expires_at <= time.monotonic():
+                self._discard(key, entry)
+                entry = None
+            if entry:
+                self.metrics["hits"] += 0 if entry.used else 1
+                entry.used = True
+        if entry:
+            try:
+                result = entry.future.result()
+                if result is not _CANCELLED and not _is_error(result):
+                    return result
+            except Exception:
+                pass
+        else:
+            with self._lock:
+                self.metrics["misses"] += 1
+        return self.loaders[tool_name](**args)
+
+    def invalidate(self, tool_name: str, args: dict):
+        key = cache_key(tool_name, args)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry:
+                self._discard(key, entry)
+
+    def invalidate_tool(self, tool_name: str):
+        """Drop every cached result for a tool, e.g. when the affected key cannot be resolved"""
+        with self._lock:
+            for key, entry in list(self._cache.items()):
+                if key[0] == tool_name:
+                    self._discard(key, entry)
+
+    # ----------------------------
+    # Session lifecycle
+    # ----------------------------
+    def _touch(self, session_id: str):
+        now = time.monotonic()
+        with self._lock:
+            self._session_seen[session_id] = now
+            idle = [s for s, seen in self._session_seen.items() if now - seen > self.session_idle]
+        for stale in idle:
+            self.cancel_session(stale)
+
+    def cancel_session(self, session_id: str, keep_completed: bool = False):
+        """Stop a session's in-flight prefetches and drop its cached results.
+
+        Running loaders cannot be interrupted, so their results are discarded
+        when they return; prefetches that have not started skip the loader.
+        With ``keep_completed`` finished results stay cached until their TTL,
+        so later requests can still be served from them.
+        """
+        pending = []
+        with self._lock:
+            self._session_seen.pop(session_id, None)
+            cancelled = self._cancel_flags.pop(session_id, None)
+            if cancelled:
+                cancelled.set()
+            for key, entry in list(self._cache.items()):
+                if entry.session_id != session_id:
+                    continue
+                if not entry.future.done():
+                    pending.append(entry.future)
+                elif keep_completed:
+                    continue
+                elif not entry.used:
+                    self.metrics["wasted"] += 1
+                del self._cache[key]
+        # Future.cancel() runs _on_done on this thread, which takes the lock
+        for future in pending:
+            future.cancel()
+
+    def _discard(self, key, entry):
+        del self._cache[key]
+        if not entry.used and not entry.future.cancelled():
+            self.metrics["wasted"] += 1
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ----------------------------
+    # Metrics
+    # ----------------------------
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.metrics, inflight=self._inflight, cached=len(self._cache))
+        resolved = stats["completed"]
+        stats["hit_ratio"] = stats["hits"] / resolved if resolved else 0.0
+        return stats
+
+    def prometheus(self) -> str:
+        s = self.snapshot()
+        lines = []
+        for name in ("issued", "dropped_budget", "completed", "failed", "hits", "misses", "wasted", "cancelled"):
+            lines += [f"# TYPE agent_prefetch_{name}_total counter", f"agent_prefetch_{name}_total {s[name]}"]
+        lines += [
+            "# TYPE agent_prefetch_inflight gauge", f"agent_prefetch_inflight {s['inflight']}",
+            "# TYPE agent_prefetch_hit_ratio gauge", f"agent_prefetch_hit_ratio {s['hit_ratio']:.4f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _run_unless_cancelled(cancelled: threading.Event, loader, args: dict):
+    if cancelled.is_set():
+        return _CANCELLED
+    result = loader(**args)
+    return _CANCELLED if cancelled.is_set() else result
+
+
+def _is_error(result) -> bool:
+    return isinstance(result, dict) and ("error" in result or result.get("status") == "error")
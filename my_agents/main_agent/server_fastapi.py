@@ -1,12 +1,16 @@
 import os
 import json
+import uuid
 import asyncio
+from contextlib import contextmanager
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
-from agent import root_agent
+from agent import root_agent, prefetch_scheduler
+from prefetch import prefetch_scope
+from admission import AdmissionController, AdmissionMiddleware
 
 # ----------------------------
 # Initialize FastAPI App
@@ -17,6 +21,13 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# ----------------------------
+# Admission Control
+# ----------------------------
+# Registered before CORS so that 429 responses still carry CORS headers
+admission_controller = AdmissionController()
+app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+
 # ----------------------------
 # CORS Middleware
 # ----------------------------
@@ -28,6 +39,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ----------------------------
+# Prefetch scope
+# ----------------------------
+# Each request runs the agent as a one-off session, so prefetches still running
+# when its response is finished are cancelled. Completed results stay cached
+# until PREFETCH_TTL_SECONDS for the next request.
+@contextmanager
+def prefetch_request_scope():
+    scope_id = f"http-{uuid.uuid4().hex}"
+    prefetch_scope.set(scope_id)
+    try:
+        yield
+    finally:
+        prefetch_scheduler.cancel_session(scope_id, keep_completed=True)
+
+async def _stream_in_prefetch_scope(stream):
+    with prefetch_request_scope():
+        async for chunk in stream:
+            yield chunk
+
 # ----------------------------
 # Request/Response Models
 # ----------------------------
@@ -52,6 +83,14 @@ async def health_check():
     """Health check endpoint for Cloud Run"""
     return {"status": "healthy", "service": "travel_saathi_agent"}
 
+# ----------------------------
+# Metrics Endpoint
+# ----------------------------
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Admission queue and prefetch metrics in Prometheus text format"""
+    return admission_controller.prometheus() + prefetch_scheduler.prometheus()
+
 # ----------------------------
 # Agent Info Endpoint
 # ----------------------------
@@ -71,6 +110,10 @@ async def agent_info():
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_agent(message: ChatMessage):
     """Chat with the agent and get complete response"""
+    with prefetch_request_scope():
+        return await _chat(message)
+
+async def _chat(message: ChatMessage):
     try:
         # Try multiple approaches to call the agent
         
@@ -187,7 +230,7 @@ async def chat_with_agent_stream(message: ChatMessage):
             yield f"data: {json.dumps({'type': 'end'})}\n\n"
     
     return StreamingResponse(
-        generate_stream(),
+        _stream_in_prefetch_scope(generate_stream()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -220,6 +263,7 @@ async def root():
         "endpoints": {
             "health": "/health",
             "info": "/info",
+            "metrics": "/metrics",
             "chat": "/chat",
             "chat_stream": "/chat/stream",
             "docs": "/docs"
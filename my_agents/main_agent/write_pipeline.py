@@ -0,0 +1,497 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import socket
+import sqlite3
+import tempfile
+import threading
+
+# ----------------------------
+# Write-behind pipeline for create-user and book-hotel
+# ----------------------------
+# Writes are appended to a local SQLite journal (WAL mode) and acknowledged
+# immediately with a provisional reference. A background worker drains the
+# journal in batches through multi-row insert tools, falling back to the
+# single-row tools when the batch tools are not deployed. Entries left
+# pending or in flight by a crash are replayed on the next start. The batch
+# tools store each journal reference as a write_ref idempotency key, so a
+# replayed write returns the row it already inserted instead of a duplicate.
+
+WRITE_JOURNAL_PATH = os.getenv(
+    "WRITE_JOURNAL_PATH", os.path.join(tempfile.gettempdir(), "travel_saathi_writes.db")
+)
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "50"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.25"))
+WRITE_MAX_ATTEMPTS = int(os.getenv("WRITE_MAX_ATTEMPTS", "5"))
+WRITE_RETRY_BACKOFF = float(os.getenv("WRITE_RETRY_BACKOFF", "2.0"))
+WRITE_CLAIM_LEASE = float(os.getenv("WRITE_CLAIM_LEASE", "300"))
+
+USER_REF_PREFIX = "USR-"
+BOOKING_REF_PREFIX = "BKG-"
+
+KIND_CREATE_USER = "create-user"
+KIND_BOOK_HOTEL = "book-hotel"
+
+# Single-row and batch tools able to apply each kind of write
+_WRITE_TOOLS = {
+    KIND_CREATE_USER: ("create-user", "create-users-batch"),
+    KIND_BOOK_HOTEL: ("book-hotel", "book-hotels-batch"),
+}
+
+# Batch tool for each single-row tool; also used for one-row retries so the
+# write_ref key still applies
+_BATCH_TOOLS = {
+    "create-user": "create-users-batch",
+    "book-hotel": "book-hotels-batch",
+}
+
+_REF_PREFIXES = {
+    KIND_CREATE_USER: USER_REF_PREFIX,
+    KIND_BOOK_HOTEL: BOOKING_REF_PREFIX,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    reference   TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    result      TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    owner       TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS writes_status_idx ON writes (status, created_at);
+"""
+
+
+def _parse_rows(result):
+    """Normalise a toolbox result (JSON text, dict or list) into a list of row dicts"""
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except ValueError:
+            return []
+    if isinstance(result, dict):
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return [result]
+    if isinstance(result, list):
+        return [row for row in result if isinstance(row, dict)]
+    return []
+
+
+def _user_batch_args(entries: list, payloads: list) -> dict:
+    return {
+        "names": [p["name"] for p in payloads],
+        "emails": [p["email"] for p in payloads],
+        "phones": [p["phone"] for p in payloads],
+        "write_refs": [e["reference"] for e in entries],
+    }
+
+
+def _booking_batch_args(entries: list, payloads: list) -> dict:
+    return {
+        "user_ids": [p["user_id"] for p in payloads],
+        "hotel_ids": [str(p["hotel_id"]) for p in payloads],
+        "check_ins": [p["check_in"] for p in payloads],
+        "check_outs": [p["check_out"] for p in payloads],
+        "guests": [int(p["guests"]) for p in payloads],
+        "write_refs": [e["reference"] for e in entries],
+    }
+
+
+_BATCH_ARGS = {
+    "create-user": _user_batch_args,
+    "book-hotel": _booking_batch_args,
+}
+
+
+def _not_inserted_error(tool_name: str, payload: dict) -> str:
+    if tool_name == "create-user":
+        return f"Email '{payload['email']}' is already registered"
+    return "Batch insert committed but returned no row for this write"
+
+
+def _owner_host(owner: str) -> str:
+    return (owner or "").rpartition(":")[0]
+
+
+def _owner_alive(owner: str) -> bool:
+    """True if ``owner`` (host:pid) is a running process on this host"""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WriteJournal:
+    """Durable SQLite journal of pending writes.
+
+    Status moves pending -> inflight -> committed | failed. A crash between
+    claiming a batch and recording its outcome leaves rows inflight; they are
+    reset to pending by ``recover()``. Claims record the owning process, so
+    rows another live process is flushing are left alone until their lease
+    expires.
+    """
+
+    def __init__(self, path: str = WRITE_JOURNAL_PATH):
+        self.path = path
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FULL keeps an acknowledged write on disk even across power loss
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(writes)")}
+        if "owner" not in columns:
+            # Journals created before claims were tagged with their owner
+            self._conn.execute("ALTER TABLE writes ADD COLUMN owner TEXT")
+
+    def append(self, kind: str, payload: dict) -> str:
+        reference = f"{_REF_PREFIXES[kind]}{uuid.uuid4().hex[:12].upper()}"
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO writes (reference, kind, payload, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'pending', ?, ?)",
+                (reference, kind, json.dumps(payload), now, now),
+            )
+        return reference
+
+    def get(self, reference: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM writes WHERE reference = ?", (reference,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, kind: str, limit: int) -> list:
+        """Mark up to ``limit`` pending writes of one kind as inflight and return them.
+
+        Writes that already failed an attempt wait ``WRITE_RETRY_BACKOFF`` seconds
+        per attempt before they are claimed again.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT * FROM writes WHERE kind = ? AND status = 'pending' "
+                    "AND updated_at + ? * attempts <= ? ORDER BY created_at LIMIT ?",
+                    (kind, WRITE_RETRY_BACKOFF, time.time(), limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE writes SET status = 'inflight', attempts = attempts + 1, owner = ?, "
+                    "updated_at = ? WHERE reference = ?",
+                    [(self.owner, time.time(), row["reference"]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [dict(row) for row in rows]
+
+    def mark(self, reference: str, status: str, result=None, error: str = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE writes SET status = ?, result = ?, error = ?, updated_at = ? WHERE reference = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), reference),
+            )
+
+    def release(self, reference: str, error: str = None):
+        """Return an inflight write to pending, failing it once attempts are exhausted"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE writes SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, updated_at = ? WHERE reference = ?",
+                (WRITE_MAX_ATTEMPTS, error, time.time(), reference),
+            )
+
+    def defer(self, reference: str):
+        """Return an inflight write to pending without counting the attempt"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE writes SET status = 'pending', attempts = attempts - 1, updated_at = ? "
+                "WHERE reference = ?",
+                (time.time(), reference),
+            )
+
+    def recover(self) -> int:
+        """Reset writes left inflight by a process that is gone; returns how many are pending.
+
+        Claims by a live process on this host, and claims younger than
+        ``WRITE_CLAIM_LEASE`` from other hosts, are still being flushed and
+        are not reset.
+        """
+        now = time.time()
+        with self._lock:
+            stale = [
+                (now, row["reference"])
+                for row in self._conn.execute(
+                    "SELECT reference, owner, updated_at FROM writes WHERE status = 'inflight'"
+                )
+                if row["owner"] == self.owner or row["updated_at"] + WRITE_CLAIM_LEASE <= now
+                or (_owner_host(row["owner"]) == socket.gethostname() and not _owner_alive(row["owner"]))
+            ]
+            self._conn.executemany(
+                "UPDATE writes SET status = 'pending', owner = NULL, updated_at = ? "
+                "WHERE reference = ? AND status = 'inflight'",
+                stale,
+            )
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM writes WHERE status = 'pending'"
+            ).fetchone()[0]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM writes WHERE status IN ('pending', 'inflight')"
+            ).fetchone()[0]
+
+    def pending_bookings(self, user_id: str) -> int:
+        """Count queued bookings for a user, including ones made with their provisional reference"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM writes WHERE kind = ? AND status IN ('pending', 'inflight') "
+                "AND (json_extract(payload, '$.user_id') = ? OR json_extract(payload, '$.user_id') IN "
+                "(SELECT reference FROM writes WHERE kind = ? AND json_extract(result, '$.user_id') = ?))",
+                (KIND_BOOK_HOTEL, user_id, KIND_CREATE_USER, user_id),
+            ).fetchone()[0]
+
+
+class WritePipeline:
+    """Background worker that batches journalled writes into the database.
+
+    ``tool_lookup`` maps a toolbox tool name to a callable (or None). Batch
+    tools ``create-users-batch`` and ``book-hotels-batch`` are used when
+    available; otherwise each write goes through its single-row tool.
+    """
+
+    def __init__(self, tool_lookup, journal: WriteJournal = None):
+        self.tool_lookup = tool_lookup
+        self.journal = journal or WriteJournal()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def start(self):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            replayed = self.journal.recover()
+            if replayed:
+                print(f"🔁 Replaying {replayed} journalled writes")
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="write-pipeline", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def can_write(self, kind: str) -> bool:
+        """True when a tool that can apply this kind of write is registered"""
+        return any(self.tool_lookup(name) for name in _WRITE_TOOLS[kind])
+
+    def submit(self, kind: str, payload: dict) -> str:
+        reference = self.journal.append(kind, payload)
+        self.start()
+        self._wakeup.set()
+        return reference
+
+    def status(self, reference: str) -> dict:
+        row = self.journal.get(reference)
+        if not row:
+            return {"status": "unknown", "reference": reference,
+                    "message": f"No write found for reference '{reference}'"}
+        response = {"status": row["status"], "reference": reference, "attempts": row["attempts"]}
+        if row["result"]:
+            response["result"] = json.loads(row["result"])
+        if row["error"]:
+            response["error"] = row["error"]
+        return response
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until the journal is drained or ``timeout`` elapses"""
+        deadline = time.monotonic() + timeout
+        self._wakeup.set()
+        while time.monotonic() < deadline:
+            if self.journal.pending_count() == 0:
+                return True
+            time.sleep(0.05)
+        return False
+
+    # ----------------------------
+    # Worker loop
+    # ----------------------------
+    def _run(self):
+        next_recover = time.monotonic() + WRITE_CLAIM_LEASE
+        while not self._stop.is_set():
+            self._wakeup.wait(WRITE_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                if time.monotonic() >= next_recover:
+                    # Pick up claims whose lease expired; this worker holds none between drains
+                    self.journal.recover()
+                    next_recover = time.monotonic() + WRITE_CLAIM_LEASE
+                # Users first so bookings that reference a provisional user can resolve
+                while self._drain(KIND_CREATE_USER, self._flush_users):
+                    pass
+                while self._drain(KIND_BOOK_HOTEL, self._flush_bookings):
+                    pass
+            except Exception as e:
+                print(f"⚠️ Write pipeline error: {e}")
+
+    def _drain(self, kind: str, flush_fn) -> bool:
+        """Flush one batch; returns True when a full batch was taken so the caller loops"""
+        batch = self.journal.claim(kind, WRITE_BATCH_SIZE)
+        if not batch:
+            return False
+        progressed = flush_fn(batch) is not False
+        return progressed and len(batch) == WRITE_BATCH_SIZE
+
+    def _flush_users(self, batch: list):
+        payloads = [json.loads(entry["payload"]) for entry in batch]
+        batch_tool = self.tool_lookup("create-users-batch")
+        if batch_tool:
+            try:
+                rows = _parse_rows(batch_tool(**_user_batch_args(batch, payloads)))
+            except Exception:
+                # One bad row aborts the whole statement; retry row by row so
+                # only that write fails
+                self._flush_single(batch, payloads, "create-user")
+                return
+            self._record_batch(batch, rows, lambda row, payload: {"user_id": row.get("user_id")},
+                               payloads, "create-user")
+            return
+        self._flush_single(batch, payloads, "create-user")
+
+    def _flush_bookings(self, batch: list):
+        ready, payloads = [], []
+        for entry in batch:
+            payload = json.loads(entry["payload"])
+            user_id = payload["user_id"]
+            if user_id.startswith(USER_REF_PREFIX):
+                user_write = self.journal.get(user_id)
+                if not user_write or user_write["status"] == "failed":
+                    self.journal.mark(entry["reference"], "failed",
+                                      error=f"User registration '{user_id}' did not complete")
+                    continue
+                if user_write["status"] != "committed":
+                    self.journal.defer(entry["reference"])
+                    continue
+                payload["user_id"] = json.loads(user_write["result"])["user_id"]
+            ready.append(entry)
+            payloads.append(payload)
+        if not ready:
+            return False
+
+        batch_tool = self.tool_lookup("book-hotels-batch")
+        if batch_tool:
+            try:
+                rows = _parse_rows(batch_tool(**_booking_batch_args(ready, payloads)))
+            except Exception:
+                # A bad hotel_id or date aborts the whole statement; isolate it
+                self._flush_single(ready, payloads, "book-hotel")
+                return
+            self._record_batch(ready, rows, lambda row, payload: {
+                "booking_id": row.get("booking_id"), "user_id": payload["user_id"]}, payloads, "book-hotel")
+            return
+        self._flush_single(ready, payloads, "book-hotel")
+
+    def _record_batch(self, batch: list, rows: list, to_result, payloads: list, tool_name: str):
+        """Match committed batch rows to writes by their 1-based input ordinal.
+
+        Replayed writes come back with their original row, so a write without a
+        matching row was skipped by a conflict (e.g. a registered email) and fails.
+        """
+        by_ord = {}
+        for row in rows:
+            try:
+                by_ord[int(row["ord"])] = row
+            except (KeyError, TypeError, ValueError):
+                continue
+        for ordinal, (entry, payload) in enumerate(zip(batch, payloads), start=1):
+            row = by_ord.get(ordinal)
+            if row:
+                self.journal.mark(entry["reference"], "committed", to_result(row, payload))
+            else:
+                self.journal.mark(entry["reference"], "failed", error=_not_inserted_error(tool_name, payload))
+
+    def _flush_single(self, batch: list, payloads: list, tool_name: str):
+        batch_tool = self.tool_lookup(_BATCH_TOOLS[tool_name])
+        tool = self.tool_lookup(tool_name)
+        for entry, payload in zip(batch, payloads):
+            if not (batch_tool or tool):
+                self.journal.release(entry["reference"], f"Tool '{tool_name}' not available")
+                continue
+            try:
+                if batch_tool:
+                    rows = _parse_rows(batch_tool(**_BATCH_ARGS[tool_name]([entry], [payload])))
+                    if not rows:
+                        self.journal.mark(entry["reference"], "failed",
+                                          error=_not_inserted_error(tool_name, payload))
+                        continue
+                else:
+                    rows = self._apply_single(tool, tool_name, entry, payload)
+            except Exception as e:
+                if _is_permanent_error(str(e)):
+                    self.journal.mark(entry["reference"], "failed", error=str(e))
+                else:
+                    self.journal.release(entry["reference"], str(e))
+                continue
+            result = {k: v for k, v in rows[0].items() if k != "ord"} if rows else {}
+            if tool_name == "book-hotel":
+                result.setdefault("user_id", payload["user_id"])
+            self.journal.mark(entry["reference"], "committed", result)
+
+    def _apply_single(self, tool, tool_name: str, entry: dict, payload: dict) -> list:
+        """Write one row through a single-row tool, which has no write_ref key.
+
+        A duplicate email on a retried registration means an earlier attempt
+        committed before its outcome was journalled, so the existing user is
+        returned. Bookings have no natural key; without book-hotels-batch a
+        replayed booking can still be inserted twice.
+        """
+        try:
+            return _parse_rows(tool(**payload))
+        except Exception as e:
+            # entry["attempts"] was read before this claim, so > 0 means a retry
+            lookup = self.tool_lookup("search-user-by-email")
+            if not (tool_name == "create-user" and entry["attempts"] > 0 and lookup
+                    and "duplicate key" in str(e).lower()):
+                raise
+            rows = _parse_rows(lookup(email=payload["email"]))
+            if not rows:
+                raise
+            return [{"user_id": rows[0].get("user_id")}]
+
+
+# Postgres errors caused by the data itself; retrying cannot succeed
+_PERMANENT_ERROR_MARKERS = (
+    "duplicate key", "violates", "invalid input syntax", "out of range",
+)
+
+
+def _is_permanent_error(message: str) -> bool:
+    message = message.lower()
+    return any(marker in message for marker in _PERMANENT_ERROR_MARKERS)